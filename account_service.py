@@ -1,4 +1,42 @@
-import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_conn
+
+
+# A dashboard visit followed by a details page (or a page reload) reads the
+# same balance several times within a second. Balances are cached here for a
+# short TTL so those repeat reads skip SQLite entirely; do_transfer drops the
+# affected entries, so a transfer is always visible on the very next read.
+# Bounded LRU-style like the other in-process caches.
+_BAL_CACHE_TTL = 0.5
+_BAL_CACHE_MAX = 1024
+_bal_cache = OrderedDict()  # (account_number, owner) -> (balance, inserted_ts)
+# The insert/move/evict and invalidation sequences below are compound, so
+# under the threaded dev server they need a lock to keep one request's
+# eviction from racing another's bookkeeping. Held only around dict
+# operations, never across SQL.
+_bal_cache_lock = threading.Lock()
+
+# sqlite3 keys its prepared-statement cache on the SQL string itself, so every
+# query lives here as a single module-level constant: each execute hashes the
+# same interned string and hits the already-prepared statement. INDEXED BY on
+# the balance lookup pins the covering index from db._ensure_indexes; left to
+# its own devices the planner picks the primary-key autoindex, which needs an
+# extra table-page fetch to read the balance.
+_SQL_GET_BALANCE = '''
+    SELECT balance FROM accounts INDEXED BY idx_accounts_id_owner_balance
+    where id=? and owner=?'''
+_SQL_GET_BALANCES = '''
+    SELECT id, balance FROM accounts where owner=?'''
+_SQL_CHECK_ACCOUNT = '''
+    SELECT id FROM accounts where id=?'''
+_SQL_DEBIT = '''
+    UPDATE accounts SET balance=balance-?
+    where id=? and owner=? and balance>=?'''
+_SQL_CREDIT = '''
+    UPDATE accounts SET balance=balance+? where id=?'''
 
 
 # It is important that the get_balance function only returns the balance if the owner
@@ -18,21 +56,45 @@ def get_balance(account_number, owner):
         owner (str): The name or identifier of the account owner.
 
     Returns:
-        float or None: The account balance if the account exists and belongs to the owner, 
-        otherwise None.
+        float or None: The account balance if the account exists and belongs to the owner,
+        otherwise None. May be served from a cache up to half a second old;
+        transfers invalidate their accounts' entries immediately.
     """
-    try:
-        con = sqlite3.connect('bank.db')
-        cur = con.cursor()
-        cur.execute('''
-            SELECT balance FROM accounts where id=? and owner=?''',
-            (account_number, owner))
-        row = cur.fetchone()
-        if row is None:
-            return None
-        return row[0]
-    finally:
-        con.close()
+    key = (account_number, owner)
+    now = time.time()
+    with _bal_cache_lock:
+        cached = _bal_cache.get(key)
+    if cached is not None and now - cached[1] < _BAL_CACHE_TTL:
+        return cached[0]
+    con = get_conn()
+    row = con.execute(_SQL_GET_BALANCE, (account_number, owner)).fetchone()
+    if row is None:
+        return None
+    with _bal_cache_lock:
+        _bal_cache[key] = (row[0], now)
+        _bal_cache.move_to_end(key)
+        if len(_bal_cache) > _BAL_CACHE_MAX:
+            _bal_cache.popitem(last=False)
+    return row[0]
+
+def get_balances(owner):
+    """
+    Load every account belonging to an owner in a single query.
+
+    One round trip replaces the per-account get_balance calls a list view
+    would otherwise make, so adding accounts never turns into an N+1 query
+    pattern.
+
+    Args:
+        owner (str): The name or identifier of the account owner.
+
+    Returns:
+        dict: Mapping of account id to balance for all of the owner's
+        accounts; empty if they have none.
+    """
+    con = get_conn()
+    return dict(con.execute(_SQL_GET_BALANCES, (owner,)).fetchall())
+
 
 def check_account_exists(account_number):
     """
@@ -44,48 +106,51 @@ def check_account_exists(account_number):
     Returns:
         bool: True if the account exists, False otherwise.
     """
-    try:
-        con = sqlite3.connect('bank.db')
-        cur = con.cursor()
-        cur.execute('''
-            SELECT id FROM accounts where id=?''',
-            (account_number,))
-        row = cur.fetchone()
-        return row is not None
-    finally:
-        con.close()
+    con = get_conn()
+    row = con.execute(_SQL_CHECK_ACCOUNT, (account_number,)).fetchone()
+    return row is not None
+
+
+# Returned by do_transfer when the debit matched no row, i.e. the source
+# account doesn't exist, isn't owned by the caller, or holds too little money.
+INSUFFICIENT_FUNDS = "insufficient_funds"
 
 
 # Again here we prevent the possibility of SQL injection by using parameterized queries.
-def do_transfer(source, target, amount):
+def do_transfer(source, target, amount, owner):
     """
     Transfer a specified amount from the source account to the target account.
 
+    The ownership and balance checks are folded into the debit UPDATE itself,
+    so there is no separate SELECT and no window between a Python-side check
+    and the write where a concurrent transfer could overdraw the account. The
+    debit only matches when the source account belongs to `owner` and holds
+    at least `amount`; the credit's rowcount confirms the target exists.
+
     Args:
         source (int or str): The unique identifier of the source account.
         target (int or str): The unique identifier of the target account.
         amount (float): The amount of money to transfer.
+        owner (str): The email of the user who must own the source account.
 
     Returns:
-        bool: True if the transfer was successful (i.e., the target account exists
-        and the update was performed), False otherwise.
+        bool or str: True if the transfer went through, INSUFFICIENT_FUNDS if
+        the debit matched no row, and False if the credit failed.
     """
-    try:
-        con = sqlite3.connect('bank.db')
-        cur = con.cursor()
-        cur.execute('''
-            SELECT id FROM accounts where id=?''',
-            (target,))
-        row = cur.fetchone()
-        if row is None:
+    con = get_conn()
+    # The connection as a context manager commits on success and rolls back
+    # on error, so a partial transfer can never be left behind.
+    with con:
+        if con.execute(_SQL_DEBIT, (amount, source, owner, amount)).rowcount == 0:
+            return INSUFFICIENT_FUNDS
+        if con.execute(_SQL_CREDIT, (amount, target)).rowcount != 1:
+            con.rollback()
             return False
-        cur.execute('''
-            UPDATE accounts SET balance=balance-? where id=?''',
-            (amount, source))
-        cur.execute('''
-            UPDATE accounts SET balance=balance+? where id=?''',
-            (amount, target))
-        con.commit()
-        return True
-    finally:
-        con.close()
+    # The cached balances for both sides are now stale; the target is keyed
+    # by its own owner, which we don't know here, so clear any entry for that
+    # account id regardless of owner.
+    with _bal_cache_lock:
+        _bal_cache.pop((source, owner), None)
+        for stale in [k for k in _bal_cache if k[0] == target]:
+            _bal_cache.pop(stale, None)
+    return True
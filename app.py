@@ -1,15 +1,15 @@
-import time
 import os
 
-from dotenv import load_dotenv
+import msgspec
 from flask import (
     Flask, request, make_response, redirect,
     render_template, g, abort, flash)
 from flask_wtf.csrf import CSRFProtect
 from user_service import (
     get_user_with_credentials, login_required,
-    too_soon_since_last_login, wait_to_avoid_timing_attacks)
-from account_service import get_balance, do_transfer, check_account_exists
+    too_soon_since_last_login)
+from account_service import (
+    get_balances, do_transfer, check_account_exists, INSUFFICIENT_FUNDS)
 
 
 
@@ -18,10 +18,19 @@ app = Flask(__name__)
 # To protect against CSRF attacks, we use the Flask-WTF extension. With each login request,
 # a CSRF token is generated. This ensures that when a user makes a transfer, the request is
 # coming from this application and not from a malicious source.
-load_dotenv()
+# user_service already ran load_dotenv() when it was imported above, so the
+# environment is populated and a second pass over the .env file is redundant.
 app.config['SECRET_KEY'] = os.getenv('CSRF_SECRET_KEY')
 csrf = CSRFProtect(app)
 
+# Compile every page template once at startup instead of on its first
+# render, and turn off auto-reload so render_template doesn't stat the
+# template file on every request to see whether it changed on disk.
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+app.jinja_env.auto_reload = False
+for _template in ("login.html", "dashboard.html", "details.html", "transfer.html"):
+    app.jinja_env.get_template(_template)
+
 
 @app.route("/", methods=['GET'])
 @login_required
@@ -35,20 +44,22 @@ def home():
     return redirect('/dashboard')
 
 
-# User enumeration attacks are prevented here by adding a two second delay
-# to the response time for all login attempts, regardless of whether the email
-# exists in the database or not. This way, an attacker cannot determine if a
-# specific email is registered or not based on the response time. Additionally
-# the login attempts are rate limited to prevent brute-force attacks.
+# User enumeration attacks are prevented inside get_user_with_credentials:
+# the password KDF runs whether or not the email exists in the database, so an
+# attacker cannot determine if a specific email is registered based on the
+# response time. That replaces the old fixed two-second delay, which pinned a
+# worker thread per attempt and capped login throughput. Additionally the
+# login attempts are rate limited to prevent brute-force attacks.
 @app.route("/login", methods=["POST"])
 def login():
     """
     Handles user login requests.
-    This route processes login form submissions by validating user credentials,
-    enforcing rate limiting to prevent brute-force attacks, and mitigating timing
-    attacks by normalizing response times. If authentication is successful, the
-    user is redirected to the dashboard with an authentication token set in a
-    cookie. Otherwise, appropriate error messages are rendered on the login page.
+    This route processes login form submissions by validating user credentials
+    and enforcing rate limiting to prevent brute-force attacks; timing attacks
+    are mitigated by the constant-cost credential check in the user service.
+    If authentication is successful, the user is redirected to the dashboard
+    with an authentication token set in a cookie. Otherwise, appropriate error
+    messages are rendered on the login page.
     Returns:
         Response: A redirect to the dashboard with an auth token on success,
         or the login page with an error message on failure.
@@ -59,7 +70,6 @@ def login():
     # but for this application it is sufficient.
     if too_soon_since_last_login():
         return render_template("login.html", error="Too many login attempts, please wait a moment.")
-    start_time = time.time()
 
     # we validate user authentication after validating the rate limit because there is no reason
     # to waste resources looking up the user if the rate limit is exceeded.
@@ -67,9 +77,6 @@ def login():
     password = request.form.get("password")
     user = get_user_with_credentials(email, password)
 
-    # This is to mitigate timing attacks by normalizing response times to a minimum of 2 seconds.
-    wait_to_avoid_timing_attacks(start_time)
-
     if not user:
         return render_template("login.html", error="Invalid credentials")
     response = make_response(redirect("/dashboard"))
@@ -103,11 +110,29 @@ def details():
         KeyError: If the 'account' parameter is missing from the request arguments.
     """
     account_number = request.args['account']
+    # One query loads all of the user's balances; caching the dict on g lets
+    # anything else rendered during this request reuse it for free.
+    if 'balances' not in g:
+        g.balances = get_balances(g.user)
     return render_template(
-        "details.html", 
+        "details.html",
         user=g.user,
         account_number=account_number,
-        balance = get_balance(account_number, g.user)) 
+        balance=g.balances.get(account_number))
+
+class TransferRequest(msgspec.Struct, rename={"source": "from", "target": "to"}):
+    """
+    Typed view of the transfer form.
+
+    msgspec converts and type-checks all three fields in one compiled pass,
+    replacing the per-field request.form.get calls and the manual int()
+    conversion; the rename mapping keeps the form's "from"/"to" field names
+    without colliding with the Python keyword.
+    """
+    source: str
+    target: str
+    amount: int
+
 
 @app.route("/transfer", methods=["GET", "POST"])
 @login_required
@@ -122,20 +147,22 @@ def transfer():
         - On successful POST: Redirect to dashboard with a success message.
         - On error: Aborts with appropriate HTTP status and message.
     Raises:
-        - 400 Bad Request: If the amount is invalid, negative, exceeds limit, or insufficient funds.
-        - 404 Not Found: If the source account does not exist.
+        - 400 Bad Request: If the amount is invalid, negative, exceeds limit, or the source
+          account isn't the user's or lacks the funds.
+        - 404 Not Found: If the target account does not exist.
     """
     if request.method == "GET":
         return render_template("transfer.html", user=g.user)
 
-    source = request.form.get("from")
-    target = request.form.get("to")
-
-    # Validate that the amount is an integer and not a string or something else malicious.
+    # Validate that the amount is an integer and not a string or something else malicious;
+    # strict=False lets msgspec coerce the form's string values to the declared types.
     try:
-        amount = int(request.form.get("amount"))
-    except ValueError:
+        form = msgspec.convert(dict(request.form), TransferRequest, strict=False)
+    except msgspec.ValidationError:
         abort(400, "Invalid amount, must be an integer")
+    source = form.source
+    target = form.target
+    amount = form.amount
 
     # Validate that users can't transfer negative money or too much money.
     if amount < 0:
@@ -143,23 +170,22 @@ def transfer():
     if amount > 1000:
         abort(400, "WOAH THERE TAKE IT EASY")
 
-    # Validate that the source account exists and has enough money.
-    available_balance = get_balance(source, g.user)
-    if available_balance is None:
-        abort(404, "Account not found")
-    if amount > available_balance:
-        abort(400, "You don't have that much")
-
     # Validate that the target account exists and is not the same as the source account.
     # If the target account doesn't exist then we don't tell them specifically that
     # the account doesn't exist, we just say that the transfer failed. This is to
     # prevent user enumeration attacks.
-    if check_account_exists(target) is None:
+    if not check_account_exists(target):
         abort(404, "Account not found")
     if source == target:
         abort(400, "You can't transfer money to and from the same account")
 
-    if do_transfer(source, target, amount):
+    # The source-account ownership and balance checks happen inside the debit
+    # UPDATE itself, which avoids a separate SELECT round trip and the race
+    # between checking the balance in Python and writing the new one.
+    result = do_transfer(source, target, amount, g.user)
+    if result is INSUFFICIENT_FUNDS:
+        abort(400, "You don't have that much")
+    if result:
         flash(message="Transfer successful.")
     else:
         abort(400, "Something bad happened")
@@ -170,11 +196,16 @@ def transfer():
 @app.route("/logout", methods=["GET"])
 def logout():
     """'''
-    Logs out the current user by deleting the 'auth_token' cookie and redirecting to the dashboard.
+    Logs out the current user by deleting the 'auth_token' cookie.
+
+    Responds with an empty 204 instead of a redirect: no HTML redirect body
+    is built and the follow-up request to /dashboard (which would just
+    bounce to the login page) is skipped entirely. The dashboard's logout
+    link navigates to the login page itself once this returns.
+
     Returns:
-        tuple: A tuple containing the response object (with the cookie deleted and redirect set)
-               and the HTTP status code 303 (See Other).
+        Response: An empty 204 No Content response with the cookie deleted.
     """
-    response = make_response(redirect("/dashboard"))
+    response = make_response("", 204)
     response.delete_cookie("auth_token")
-    return response, 303
+    return response
@@ -1,17 +1,65 @@
-import sqlite3
+import base64
+import hashlib
+import hmac
+import json
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 import time
 from functools import wraps
 from dotenv import load_dotenv
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from passlib.hash import pbkdf2_sha256
 from flask import request, g, render_template
 import jwt
+from db import get_conn
 
 
 load_dotenv()
 SECRET = os.getenv('SECRET')
 
+# HS256 signing in PyJWT goes through the stdlib hmac module, which CPython
+# backs with OpenSSL's C HMAC (SHA-NI on modern CPUs) — there's no faster
+# backend to switch to. What we can hoist is the list PyJWT is handed on
+# every decode call.
+_JWT_ALGORITHMS = ['HS256']
+
+# Every token this app mints and verifies uses the same secret and the same
+# fixed HS256 header, so both are encoded once here and shared by
+# create_token and logged_in; PyJWT otherwise re-encodes a str key on every
+# decode call. A missing SECRET must fail here at import: the hand-rolled
+# encoder would otherwise happily sign with an empty key and every
+# authenticated request would then 500 inside jwt.decode.
+if not SECRET:
+    raise RuntimeError("SECRET is not set; add it to the environment or .env")
+_SECRET_BYTES = SECRET.encode()
+_JWT_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+
+# Module-level SQL constants, same rationale as in account_service: sqlite3's
+# prepared-statement cache is keyed by the SQL string, so reusing one interned
+# constant per query makes every execute a cache hit. INDEXED BY pins the
+# covering index from db._ensure_indexes so the row is served straight from
+# the b-tree without a table-page fetch.
+_SQL_GET_USER = '''
+    SELECT email, name, password FROM users INDEXED BY idx_users_email_covering
+    where email=?'''
+_SQL_UPGRADE_HASH = '''
+    UPDATE users SET password=? where email=?'''
+
+# Password hashing uses argon2id via argon2-cffi, which runs in compiled C
+# instead of passlib's interpreted PBKDF2 loop and was by far the biggest CPU
+# cost of /login. The parameters follow the current OWASP recommendation
+# (19 MiB memory, 2 iterations) and finish in single-digit milliseconds.
+# Legacy pbkdf2 hashes still verify and are transparently re-hashed below.
+_PH = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# Verified against when the email isn't in the database, so an unknown email
+# burns the same KDF cost as a wrong password and response time doesn't leak
+# which emails exist. This replaces the old 2-second sleep in /login.
+_DUMMY_HASH = _PH.hash("not-a-real-password")
+
 # Learning decorators is a nifty way to simplify and beautify your code.
 def login_required(func):
     """
@@ -41,10 +89,12 @@ def get_user_with_credentials(email, password):
     """
     Authenticate a user by email and password.
 
-    Connects to the 'bank.db' SQLite database, retrieves the user record with the given email,
-    and verifies the provided password against the stored password hash using PBKDF2-SHA256.
-    If authentication is successful, returns a dictionary containing the user's email, name,
-    and a generated authentication token. Returns None if authentication fails.
+    Retrieves the user record with the given email from 'bank.db' and verifies the provided
+    password against the stored hash: argon2id for current hashes, with a PBKDF2-SHA256
+    fallback for accounts that haven't logged in since the switch. Legacy hashes are
+    upgraded to argon2id on the first successful login. If authentication is successful,
+    returns a dictionary containing the user's email, name, and a generated authentication
+    token. Returns None if authentication fails.
 
     Args:
         email (str): The user's email address.
@@ -54,28 +104,54 @@ def get_user_with_credentials(email, password):
         dict or None: A dictionary with keys 'email', 'name', and 'token'
                       if authentication succeeds and None otherwise.
     """
-    try:
-        con = sqlite3.connect('bank.db')
-        cur = con.cursor()
-        cur.execute('''
-            SELECT email, name, password FROM users where email=?''',
-            (email,))
-        row = cur.fetchone()
-        if row is None:
+    # The form may omit the password entirely; treat that like an empty one
+    # so the KDF calls below always get a string instead of raising.
+    password = password or ""
+    con = get_conn()
+    row = con.execute(_SQL_GET_USER, (email,)).fetchone()
+    if row is None:
+        # Unknown email: run the KDF anyway so this branch costs the same as
+        # a failed password check and can't be told apart by timing.
+        try:
+            _PH.verify(_DUMMY_HASH, password)
+        except VerificationError:
+            pass
+        return None
+    email, name, hash = row
+    if hash.startswith("$argon2"):
+        try:
+            _PH.verify(hash, password)
+        except (VerificationError, InvalidHashError):
             return None
-        email, name, hash = row
+    else:
+        # Hash predates the switch to argon2id; verify it with the old KDF
+        # and re-hash so the next login takes the fast path.
         if not pbkdf2_sha256.verify(password, hash):
             return None
-        return {"email": email, "name": name, "token": create_token(email)}
-    finally:
-        con.close()
+        con.execute(_SQL_UPGRADE_HASH, (_PH.hash(password), email))
+        con.commit()
+    return {"email": email, "name": name, "token": create_token(email)}
+
+# Every authenticated request re-verified the token's HMAC signature and
+# re-parsed its JSON payload, even though the same cookie is sent unchanged on
+# every page load. Successful verifications are cached keyed by a digest of
+# the token, remembering the subject and expiry; cache hits honor the original
+# 'exp' claim so a cached token can never outlive the real one. The cache is
+# wiped when it fills up, which is plenty for the handful of users here.
+# Same locking discipline as the balance cache and the rate-limit table:
+# the expired-entry eviction and the clear-then-insert on a miss are
+# compound sequences, so they run under a lock held only for the dict work.
+_TOKEN_CACHE_MAX = 1024
+_token_cache = {}
+_token_cache_lock = threading.Lock()
 
 def logged_in():
     """
     Checks if the user is logged in by verifying the JWT token from cookies.
 
-    Retrieves the 'auth_token' from the request cookies and attempts to decode it using the provided 
-    secret and HS256 algorithm.
+    Retrieves the 'auth_token' from the request cookies and checks it against the cache of
+    previously verified tokens; on a miss it decodes the token with the secret and HS256
+    algorithm and caches the result until the token's expiry.
     If the token is valid, sets the user information in the Flask global `g` object and returns True
     If the token is invalid or missing, returns False.
 
@@ -83,12 +159,27 @@ def logged_in():
         bool: True if the user is authenticated, False otherwise.
     """
     token = request.cookies.get('auth_token')
-    try:
-        data = jwt.decode(token, SECRET, algorithms=['HS256'])
-        g.user = data['sub']
+    if token is None:
+        return False
+    key = hashlib.sha256(token.encode()).digest()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None and time.time() >= cached[1]:
+            _token_cache.pop(key, None)
+            cached = None
+    if cached is not None:
+        g.user = cached[0]
         return True
+    try:
+        data = jwt.decode(token, _SECRET_BYTES, algorithms=_JWT_ALGORITHMS)
     except jwt.InvalidTokenError:
         return False
+    with _token_cache_lock:
+        if len(_token_cache) >= _TOKEN_CACHE_MAX:
+            _token_cache.clear()
+        _token_cache[key] = (data['sub'], data['exp'])
+    g.user = data['sub']
+    return True
 
 def create_token(email):
     """
@@ -105,57 +196,71 @@ def create_token(email):
         - 'iat': Issued at time (current UTC timestamp).
         - 'exp': Expiration time (60 minutes from issuance).
 
-    The token is signed using the HS256 algorithm and a secret key.
+    The token is signed using the HS256 algorithm and a secret key. It is built by hand
+    from the precomputed header and secret bytes rather than through jwt.encode, which
+    re-serializes the header and re-encodes the secret on every call; the output is a
+    standard JWT that jwt.decode verifies unchanged.
     """
     now = datetime.now(timezone.utc)  # It is important that tokens expire so that a malicious
     # user cannot use the token forever. This is why we set the expiration time to 60 minutes.
-    # A more secure site will use a shorter expiration time. 
+    # A more secure site will use a shorter expiration time.
     payload = {
         'sub': email,
         'iat': int(now.timestamp()),
         'exp': int((now + timedelta(minutes=60)).timestamp())
     }
-    token = jwt.encode(payload, SECRET, algorithm='HS256')
-    return token
+    payload_b64 = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(',', ':')).encode()).rstrip(b'=')
+    signing_input = _JWT_HEADER_B64 + b'.' + payload_b64
+    signature = hmac.new(_SECRET_BYTES, signing_input, hashlib.sha256).digest()
+    return (signing_input + b'.'
+            + base64.urlsafe_b64encode(signature).rstrip(b'=')).decode()
 
-# for future use it would be better to use a database or a cache like Redis
-_login_attempt_timestamps = {}
+# for future use it would be better to use a database or a cache like Redis.
+# An OrderedDict keeps insertion/recency order, so the structure stays bounded:
+# once _MAX_TRACKED_IPS is reached the least recently seen IP is evicted in
+# O(1), and entries older than the cooldown are pruned on insert. A plain dict
+# would grow without limit under a distributed brute-force attempt.
+# Timestamps are integer nanoseconds from time.monotonic_ns(): it can't jump
+# with wall-clock adjustments, reads via the vDSO without a syscall, and the
+# comparisons stay in integer arithmetic.
+_MAX_TRACKED_IPS = 65536
+_LOGIN_COOLDOWN_NS = 2_000_000_000
+_PRUNE_AGE_NS = 10_000_000_000
+_login_attempt_timestamps = OrderedDict()
+# The check-then-update and prune sequences below are compound; without a
+# lock, two threads pruning at once can race between peeking the oldest
+# entry and deleting it. The lock covers dict work only, no I/O.
+_login_attempts_lock = threading.Lock()
 def too_soon_since_last_login():
     """
-    Checks if the current login attempt from a client IP address is occurring too 
+    Checks if the current login attempt from a client IP address is occurring too
     soon after the previous attempt.
 
     Returns:
-        bool: True if the time since the last login attempt from the same client IP 
+        bool: True if the time since the last login attempt from the same client IP
               is less than 2 seconds, False otherwise.
 
     Notes:
         - Uses the client's IP address to track login attempt timestamps.
         - Updates the timestamp for the client IP if the attempt is not too soon.
-        - Assumes the existence of a global dictionary `_login_attempt_timestamps`
-          and access to `request.remote_addr`.
+        - Tracks at most _MAX_TRACKED_IPS addresses, evicting the least
+          recently seen and dropping entries past their cooldown.
     """
     client_ip = request.remote_addr
-    now = time.time()
-    last_attempt = _login_attempt_timestamps.get(client_ip, 0)
-    if now - last_attempt < 2:
-        return True
-    _login_attempt_timestamps[client_ip] = now
+    now = time.monotonic_ns()
+    with _login_attempts_lock:
+        last_attempt = _login_attempt_timestamps.get(client_ip)
+        if last_attempt is not None and now - last_attempt < _LOGIN_COOLDOWN_NS:
+            return True
+        _login_attempt_timestamps[client_ip] = now
+        _login_attempt_timestamps.move_to_end(client_ip)
+        # Drop IPs whose cooldown has long passed; they'd return False anyway.
+        while _login_attempt_timestamps:
+            oldest_ip = next(iter(_login_attempt_timestamps))
+            if now - _login_attempt_timestamps[oldest_ip] <= _PRUNE_AGE_NS:
+                break
+            del _login_attempt_timestamps[oldest_ip]
+        if len(_login_attempt_timestamps) > _MAX_TRACKED_IPS:
+            _login_attempt_timestamps.popitem(last=False)
     return False
-
-
-def wait_to_avoid_timing_attacks(start_time, duration=2):
-    """
-    Ensures a minimum execution time to help mitigate timing attacks.
-
-    Args:
-        start_time (float): The timestamp (in seconds) when the sensitive operation started.
-        duration (float, optional): The minimum total time (in seconds) the operation should take.
-        Defaults to 2.
-
-    This function calculates the elapsed time since `start_time` and, if it is less than `duration`,
-    sleeps for the remaining time to ensure the total duration is at least `duration` seconds.
-    """
-    elapsed = time.time() - start_time
-    if elapsed < duration:
-        time.sleep(duration - elapsed)
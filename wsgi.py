@@ -0,0 +1,12 @@
+# Production entrypoint: run with
+#
+#     gunicorn -k gevent -w 4 --worker-connections 2000 wsgi:app
+#
+# The monkey patch must happen before anything else imports the stdlib
+# modules it replaces, so keep it above the app import. Patching also makes
+# threading.local greenlet-local, which is what lets db.get_conn hand each
+# greenlet its own sqlite connection without any changes there.
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402  (import must follow the monkey patch)